@@ -33,8 +33,219 @@ Examples
 'g$actc'
 """
 
+import warnings
 import numpy as np
-from re import findall 
+
+try:
+    from numba import njit, prange
+    has_numba = True
+except ImportError:
+    ## numba is optional: without it the jitted functions
+    ## simply run as plain Python
+    has_numba = False
+    prange = range
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+try:
+    from pydivsufsort import divsufsort
+except ImportError:
+    ## pydivsufsort is optional: without it the suffix array
+    ## is built by prefix doubling
+    divsufsort = None
+
+try:
+    import cupy
+except ImportError:
+    ## cupy is optional: without it the "cuda" backend
+    ## falls back to the CPU
+    cupy = None
+
+_ALLOWED_TERMINATORS = frozenset("$&*-%#")
+
+
+def _to_codes(s):
+    """
+    Convert a string into an array of integer character codes.
+
+    ASCII strings are stored as uint8 (one byte per character); any
+    other string falls back to uint32 Unicode codepoints (lone surrogates
+    included), so that the ordering of the codes always matches the 
+    ordering of the characters.
+    """
+    if s.isascii():
+        return np.frombuffer(s.encode("ascii"), dtype=np.uint8)
+    return np.frombuffer(s.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+
+def _from_codes(codes):
+    """
+    Convert an array of character codes (see _to_codes) back to a string.
+    """
+    if codes.dtype == np.uint8:
+        return codes.tobytes().decode("ascii")
+    return codes.tobytes().decode("utf-32-le", "surrogatepass")
+
+
+@njit(cache=True)
+def _bucket_sort(codes, starts):
+    """
+    Sort the positions of an array of codes by character (counting sort).
+
+    starts[c] must be the number of codes smaller than c: it is the 
+    first free slot of the bucket of c, and is updated in place. The 
+    buckets are at most one per character, so the slots being written 
+    stay in cache.
+    """
+    order = np.empty(len(codes), dtype=np.int32)
+    for i in range(len(codes)):
+        c = codes[i]
+        order[starts[c]] = i
+        starts[c] += 1
+    return order
+
+
+@njit(cache=True, parallel=True)
+def _pair_keys(suffix_array, rank, h):
+    """
+    Build the doubling keys (rank[i], rank[i+h]+1), packed in an int64, 
+    in the order of the suffix array. Every key is independent of the 
+    others, so the loop runs in parallel.
+    """
+    N = len(suffix_array)
+    key = np.empty(N, dtype=np.int64)
+    for p in prange(N):
+        i = suffix_array[p]
+        k = np.int64(rank[i]) * (N+1)
+        if i + h < N:
+            k += rank[i+h] + 1
+        key[p] = k
+    return key
+
+
+@njit(cache=True, parallel=True)
+def _assign_ranks(suffix_array, key, rank):
+    """
+    Give to each suffix the number of distinct keys preceding its own 
+    in the sorted keys, in place. Marking where the key changes and 
+    scattering the ranks both run in parallel, around a prefix sum.
+    """
+    N = len(suffix_array)
+    change = np.empty(N, dtype=np.int32)
+    change[0] = 0
+    for p in prange(1, N):
+        change[p] = key[p] != key[p-1]
+    groups = np.cumsum(change)
+    for p in prange(N):
+        rank[suffix_array[p]] = groups[p]
+
+
+def _suffix_array(codes, xp=np):
+    """
+    Build the suffix array of an array of character codes.
+
+    Suffixes are sorted by prefix doubling (Manber-Myers / qsufsort): 
+    after the k-th round every suffix has a rank given by its first 2^k 
+    characters, and sorting the pairs (rank[i], rank[i+h]) gives the 
+    ranks for the first 2h characters. A suffix shorter than h gets -1 
+    as second rank, so that it precedes all the longer suffixes sharing 
+    the same prefix, as in ordinary string comparison. Each round is a 
+    single sort of N integer keys; with numba, building the keys and 
+    assigning the new ranks run in parallel threads.
+    The first round packs the first k characters of each suffix in a 
+    uint64 key, using just enough bits per character for the alphabet 
+    of the string: for DNA (ACGT and the terminator) 3 bits, so that 
+    a single sort ranks the prefixes of 21 characters and several 
+    doubling rounds are skipped.
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        Integer codes of the characters of the string.
+    xp : module, optional
+        Array module to compute with: numpy (default) or cupy, in which 
+        case codes must be a cupy array and the sorts run on the GPU.
+
+    Returns
+    -------
+    numpy.ndarray
+        Start positions of the suffixes, sorted lexicographically.
+    """
+    N = len(codes)
+    parallel = xp is np and has_numba
+    ## the rank of a character is its position in the alphabet,
+    ## i.e. among the codes with a nonzero count
+    counts = xp.bincount(codes)
+    alphabet_rank = xp.cumsum(counts > 0, dtype=np.int32) - 1
+    rank = alphabet_rank[codes]
+    
+    ## first pass: sort by the first k characters, packed in a
+    ## uint64 key as ranks 1..sigma, 0 being past the end
+    sigma = int(alphabet_rank[-1]) + 1
+    bits = sigma.bit_length()
+    k = min(64 // bits, N)
+    key = xp.zeros(N, dtype=np.uint64)
+    for j in range(k):
+        key <<= np.uint64(bits)
+        key[0:N-j] |= (rank[j:] + 1).astype(np.uint64)
+    suffix_array = xp.argsort(key)
+    key = key[suffix_array]
+    if parallel:
+        _assign_ranks(suffix_array, key, rank)
+    else:
+        rank[suffix_array[0]] = 0
+        rank[suffix_array[1:]] = xp.cumsum(key[1:] != key[:-1], dtype=np.int32)
+    
+    h = k
+    ## stop when every suffix is in its own group
+    while rank[suffix_array[-1]] < N-1:
+        ## both ranks are smaller than N, so the pair can be packed in
+        ## a single int64 key (rank[i], rank[i+h]+1) and sorted at once;
+        ## the keys are taken in the current order, which is already
+        ## sorted by rank[i], so the stable sort only has to reorder
+        ## the suffixes inside each group
+        if parallel:
+            key = _pair_keys(suffix_array, rank, h)
+        else:
+            key = rank.astype(np.int64) * (N+1)
+            key[0:N-h] += rank[h:] + 1
+            key = key[suffix_array]
+        order = xp.argsort(key, kind="stable")
+        suffix_array = suffix_array[order]
+        key = key[order]
+        if parallel:
+            _assign_ranks(suffix_array, key, rank)
+        else:
+            rank[suffix_array[0]] = 0
+            rank[suffix_array[1:]] = xp.cumsum(key[1:] != key[:-1], dtype=np.int32)
+        h *= 2
+    return suffix_array
+
+
+@njit(cache=True)
+def _walk(codes, T, start, N):
+    """
+    Walk the transformed string back to front, from the terminator.
+
+    Each step jumps from L[i] to the character preceding it in the 
+    original string, at position T[i] of L, and writes it directly in 
+    the output. The loop is inherently sequential, so it is compiled 
+    with numba when available.
+
+    Returns
+    -------
+    numpy.ndarray
+        Codes of the original string, without the terminator.
+    """
+    decoded_codes = np.empty(N-1, dtype=codes.dtype)
+    ## the terminator is the last character: skip it
+    i = T[start]
+    for j in range(N-2, -1, -1):
+        decoded_codes[j] = codes[i]
+        i = T[i]
+    return decoded_codes
 
 
 class TerminatorError(ValueError):
@@ -55,9 +266,25 @@ class TerminatorError(ValueError):
         self.msg=msg
         self.error_code=error_code
         super().__init__(self.msg)
+
+
+def _check_terminator(terminator):
+    """
+    Check that the terminator is a single allowed character, raising a
+    TerminatorError (codes 4, 5, 6) otherwise.
+    """
+    if not isinstance(terminator, str):
+        raise TerminatorError("The terminator must be a string of length 1",
+                              error_code = 4)
+    if len(terminator) != 1:
+        raise TerminatorError("The terminator must be a string of length 1",
+                              error_code = 5)
+    if terminator not in _ALLOWED_TERMINATORS:
+        raise TerminatorError("Allowed characters for terminator are: $&*-%# ($ default)",
+                              error_code = 6)
         
 
-def bwTransform(x, terminator = "$"):
+def bwTransform(x, terminator = "$", backend = "cpu"):
     """
     Compute the Burrows-Wheeler transform of an input string.
 
@@ -65,6 +292,11 @@ def bwTransform(x, terminator = "$"):
     ----------
     x : str
         The string to transform. Cannot contain the terminator character $.
+    backend : str, optional
+        Where to sort the suffixes: "cpu" (default) or "cuda". The "cuda" 
+        backend needs cupy and a GPU, and only pays off for inputs of 
+        millions of characters; if either is missing, a warning is 
+        raised and the CPU is used.
 
     Raises
     ------
@@ -72,6 +304,8 @@ def bwTransform(x, terminator = "$"):
         If the input is not a string.
     TerminatorError
         If the input contains the terminator character ("$").
+    ValueError
+        If the backend is not "cpu" or "cuda".
 
     Returns
     -------
@@ -98,6 +332,13 @@ def bwTransform(x, terminator = "$"):
     suffixes sorted lexicographically. The BWT of X is defined as B[i]=$ 
     when S(i)=0 and B[i]=X[S(i)−1] otherwise; this is another way to 
     obtain the last column of the matrix without performing the rotations.
+    The suffix array is built by prefix doubling (as in qsufsort [3]_): 
+    suffixes are first grouped by their first character, then by their 
+    first 2, 4, 8... characters, so that at most log2(N) sorts of 
+    integer pairs are needed. If the pydivsufsort package is installed, 
+    the suffix array is instead built in linear time by libdivsufsort. 
+    With the "cuda" backend, the prefix doubling runs on the GPU 
+    through cupy, where each sort is a parallel radix sort.
     
     References
     --------
@@ -106,6 +347,8 @@ def bwTransform(x, terminator = "$"):
     Equipment Corporation.
     .. [2] Li H, Durbin R. Fast and accurate short read alignment with 
     Burrows-Wheeler transform. Bioinformatics. 2009;25(14):1754-1760. 
+    .. [3] Larsson N.J, Sadakane K. Faster suffix sorting. Theoretical 
+    Computer Science. 2007;387(3):258-272.
     
     Examples
     --------
@@ -116,36 +359,45 @@ def bwTransform(x, terminator = "$"):
     ## input validation
     if not isinstance(x, str):
         raise TypeError("The input is not a string")
-    if not isinstance(terminator, str):
-        raise TerminatorError("The terminator must be a string of length 1",
-                              error_code = 4)
-    if len(terminator) != 1:
-        raise TerminatorError("The terminator must be a string of length 1",
-                              error_code = 5)
+    _check_terminator(terminator)
     if x.find(terminator) != -1:
         raise TerminatorError("The input cannot contain the terminator character ('{}'). Please provide another string.".format(terminator),
                               error_code = 1)
-    ## adding the terminator
-    allowed_ter = "$&*-%#"
-    if allowed_ter.find(terminator) == -1:
-        raise TerminatorError("Allowed characters for terminator are: $&*-%# ($ default)",
-                              error_code = 6)
-    x = x + terminator
-    N = len(x)
+    if backend not in ("cpu", "cuda"):
+        raise ValueError("The backend must be 'cpu' or 'cuda'")
+    if backend == "cuda" and (cupy is None or not cupy.cuda.is_available()):
+        warnings.warn("cupy or a CUDA device is not available, using the CPU backend",
+                      RuntimeWarning)
+        backend = "cpu"
+    ## the characters are turned into integer codes once, and the 
+    ## terminator is appended to the array of codes rather than to 
+    ## the string; all the following steps work on this array
+    x_codes = _to_codes(x)
+    N = len(x_codes) + 1
+    codes = np.empty(N, dtype=x_codes.dtype)
+    codes[0:N-1] = x_codes
+    codes[N-1] = ord(terminator)
     
     ## sorting all suffixes
-    ## the list comprehension part creates the suffixes 
-    ## and then np.argsort gives the indexes of the sorted
-    ## suffixes
-    suffix_array = np.argsort([x[i:] for i in range(N)])
+    ## the suffixes are sorted on the GPU by prefix doubling, by 
+    ## libdivsufsort if available, otherwise by prefix doubling on
+    ## the CPU, without creating the suffixes as strings
+    if backend == "cuda":
+        suffix_array = cupy.asnumpy(_suffix_array(cupy.asarray(codes), xp=cupy))
+    elif divsufsort is not None:
+        suffix_array = divsufsort(codes)
+    else:
+        suffix_array = _suffix_array(codes)
     
     ## subtracting 1 from the index of sorted suffixes gives us the
     ## position on x of the last letter of the column. If 0,
-    ## it becomes N-1 since the last character is $.
-    bwt_indexes = np.where(suffix_array>0, suffix_array-1, N-1)
+    ## it becomes N-1 since the last character is $: no need to
+    ## fix it, as the index -1 already points to the last code
+    bwt_indexes = suffix_array - 1
     
     ## building transformed string
-    coded_seq = "".join([x[i] for i in bwt_indexes])
+    ## (a single gather on the array of codes)
+    coded_seq = _from_codes(codes[bwt_indexes])
     return coded_seq
 
 def bwInverse(y, terminator= "$"):
@@ -190,10 +442,12 @@ def bwInverse(y, terminator= "$"):
     character of S, L[T[i]] precedes it in S; then, substituting j=T[i], 
     L[T[j]] precedes T[j], and so on; this way, we reconstruct S back to 
     front.
-    The function constructs an array P[N] and a dictionary C. C[ch] is the 
+    The function constructs two arrays P[N] and C. C[ch] is the 
     total number of instances in L (the transformed string) of characters 
     preceding ch in the alphabet. P[i] is the number of instances of 
-    character L[i] in the prefix L[0:i] of L. 
+    character L[i] in the prefix L[0:i] of L; it is obtained from a 
+    stable sort of L, where the copies of each character keep their 
+    relative order. 
     T is defined as T[i]=P[i]+C[L[i]] for each i. In fact, the match of 
     L[i] in F can be found without building F by summing up
     a. how many characters in total precede L[i] in L (stored in C[L[i]]) 
@@ -216,62 +470,56 @@ def bwInverse(y, terminator= "$"):
     ##input validation 
     if not isinstance(y, str):
         raise TypeError("The input is not a string")
-    if not isinstance(terminator, str):
-        raise TerminatorError("The terminator must be a string of length 1",
-                              error_code = 4)
-    if len(terminator) != 1:
-        raise TerminatorError("The terminator must be a string of length 1",
-                              error_code = 5)
-    if y.find(terminator) == -1:
+    _check_terminator(terminator)
+    ## the string is encoded once: the counts of its characters
+    ## are used both for validation and for the C array
+    N = len(y)
+    codes = _to_codes(y)
+    counts = np.bincount(codes, minlength=256)
+    n_terminators = counts[ord(terminator)]
+    if n_terminators == 0:
         raise TerminatorError("The input does not contain the terminator character ('{}'). Please provide a coded string.".format(terminator),
                               error_code = 2)
-    if len(findall("\$", y)) > 1:
+    if n_terminators > 1:
         raise TerminatorError("The terminator ('{}') cannot be present more than once in the coded string. Please provide another string.".format(terminator),
                               error_code = 3)   
-    allowed_ter = "$&*-%#"
-    if allowed_ter.find(terminator) == -1:
-        raise TerminatorError("Allowed characters for terminator are: $&*-%# ($ default)",
-                              error_code = 6)
-    N = len(y)
+    
+    ## computing C array (which i call count_alphabet and is indexed
+    ## by character code): how many characters in L precede each
+    ## letter alphabetically? It is the cumulative sum of the counts
+    ## of all the previous letters
+    count_alphabet = np.zeros(len(counts), dtype=np.int32)
+    np.cumsum(counts[:-1], out=count_alphabet[1:])
+    
     ## empty array for counts
-    count_L = np.array(np.zeros(N))
+    count_L = np.empty(N, dtype=np.int32)
     
     ## computing P array (which i call count_L)
-    for i in range(N):
-        char = y[i]
-        char_occurrences = y[0:i].count(char)
-        count_L[i] = char_occurrences
-        
-    ## computing C array (which i call count_alphabet and is a dictionary
-    ## because I can use letters as keys)
-    alphabet = np.sort(np.unique(list(y)))
-    count_alphabet = {}
-    ## initialize: no letter comes before the first one
-    first_letter = alphabet[0]
-    count_alphabet[first_letter] = 0
-    
-    ## could've done a dict comprehension but it was unreadable
-    ## so I did a for loop
-    for i in range(1, len(alphabet)):
-        ## how many characters in L precede "letter" alphabetically?
-        ## to do this I sum count_alphabet[prev_letter] and the counts 
-        ## of "prev_letter" in L
-        letter = alphabet[i]
-        prev_letter = alphabet[i-1]
-        count_alphabet[letter] = count_alphabet[prev_letter] + y.count(prev_letter)
+    ## a stable sort keeps the copies of each character in the same
+    ## order as in L, so the rank of L[i] among the copies of its
+    ## character is the number of its occurrences in L[0:i]; the
+    ## copies of a letter start at position C[letter] of the sorted L,
+    ## so the counting sort can start from C itself
+    if has_numba:
+        order = _bucket_sort(codes, count_alphabet.copy())
+    else:
+        order = np.argsort(codes, kind="stable")
+    count_L[order] = np.arange(N) - count_alphabet[codes[order]]
     
+    ## computing T array, all at once: the walk below then only
+    ## needs one lookup per character
+    T = count_L + count_alphabet[codes]
+        
     ## start from the terminator character and retrieve index of
-    ## preceding character. Append them in a vector. Then find character
+    ## preceding character. Write it in a vector. Then find character
     ## preceding that one and so on. This gives us the letters of S in 
-    ## inverse order (as their position on L)
-    i = y.find(terminator)
-    decoded_indexes = np.array(np.zeros(N), dtype="int")
-    
-    for j in range(N-1, -1, -1):
-        decoded_indexes[j] = i
-        i = int(count_L[i] + count_alphabet[y[i]])
+    ## inverse order, already without the terminator. The terminator
+    ## is the only copy of its character, so it is found in the sorted
+    ## L at position C[terminator]
+    start = order[count_alphabet[ord(terminator)]]
+    decoded_codes = _walk(codes, T, start, N)
         
-    ## building original string + omitting terminator
-    decoded_seq="".join([y[i] for i in decoded_indexes])[0:N-1]    
+    ## building original string
+    decoded_seq = _from_codes(decoded_codes)
     ## return the string 
     return decoded_seq
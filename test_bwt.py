@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 """ Tests for the paleni-bwt module """
 
+import random
 import unittest
+import warnings
+from unittest import mock
 import bwt as bwt
 
 class TestBWT(unittest.TestCase):
@@ -11,11 +14,85 @@ class TestBWT(unittest.TestCase):
         self.assertEqual(bwt.bwTransform("ciao"), 'oi$ca')
         self.assertEqual(bwt.bwTransform("itopinon"), 'np$ointoi')
 
+    def test_transform_repeats(self):
+        ## check transform on strings with long repeated prefixes,
+        ## against the last column of the sorted rotations, both with
+        ## libdivsufsort (if installed) and with prefix doubling
+        for divsufsort in [bwt.divsufsort, None]:
+            with mock.patch.object(bwt, "divsufsort", divsufsort):
+                for s in ["aaaaaaa", "banana", "mississippi", "abababab",
+                          "acgt" * 10 + "aacgtt" + "a" * 30]:
+                    x = s + "$"
+                    rotations = sorted(x[i:] + x[:i] for i in range(len(x)))
+                    expected = "".join(r[-1] for r in rotations)
+                    self.assertEqual(bwt.bwTransform(s), expected)
+
+    def test_suffix_array(self):
+        ## check the prefix doubling sort directly, with the jitted 
+        ## helpers and with plain numpy (the code used by cupy)
+        for has_numba in [True, False]:
+            with mock.patch.object(bwt, "has_numba", has_numba):
+                for s in ["banana", "mississippi", "abababab", "àèì ciao"]:
+                    x = s + "$"
+                    expected = sorted(range(len(x)), key=lambda i: x[i:])
+                    suffix_array = bwt._suffix_array(bwt._to_codes(x))
+                    self.assertEqual(list(suffix_array), expected)
+
+    def test_backend(self):
+        ## check that the cuda backend gives the same transform, falling
+        ## back to the CPU when cupy or a GPU is not available
+        expected = bwt.bwTransform("mississippi")
+        if bwt.cupy is None:
+            with self.assertWarns(RuntimeWarning):
+                coded = bwt.bwTransform("mississippi", backend="cuda")
+        else:
+            with warnings.catch_warnings():
+                ## a GPU may still be missing
+                warnings.simplefilter("ignore", RuntimeWarning)
+                coded = bwt.bwTransform("mississippi", backend="cuda")
+        self.assertEqual(coded, expected)
+        with self.assertRaises(ValueError):
+            bwt.bwTransform("ciao", backend="tpu")
+
+    def test_suffix_array_packing(self):
+        ## check the packed first round: a single character (sigma=1),
+        ## strings shorter than the packed prefix (k=N) and an alphabet
+        ## of 301 characters, which needs 9 bits per character
+        wide = "".join(chr(0x100 + (i * 37) % 300) for i in range(600))
+        for has_numba in [True, False]:
+            with mock.patch.object(bwt, "has_numba", has_numba):
+                for x in ["$", "a$", "acg$", "gattaca$", "abcdefghij$",
+                          wide + "$"]:
+                    expected = sorted(range(len(x)), key=lambda i: x[i:])
+                    suffix_array = bwt._suffix_array(bwt._to_codes(x))
+                    self.assertEqual(list(suffix_array), expected)
+
+    def test_suffix_array_parallel(self):
+        ## check that the parallel helpers of numba and the numpy code
+        ## give the same suffix array, on a periodic and a random string
+        rng = random.Random(0)
+        random_s = "".join(rng.choice("acgt") for i in range(1000))
+        for s in ["ab" * 500, random_s]:
+            codes = bwt._to_codes(s + "$")
+            with mock.patch.object(bwt, "has_numba", True):
+                parallel = bwt._suffix_array(codes)
+            with mock.patch.object(bwt, "has_numba", False):
+                vectorized = bwt._suffix_array(codes)
+            self.assertEqual(list(parallel), list(vectorized))
+
     def test_inverse(self):
         ## check inverse
         self.assertEqual(bwt.bwInverse("oi$ca"), 'ciao')
         self.assertEqual(bwt.bwInverse("np$ointoi"), 'itopinon')
 
+    def test_roundtrip(self):
+        ## check that the inverse gives back the original string
+        for divsufsort in [bwt.divsufsort, None]:
+            with mock.patch.object(bwt, "divsufsort", divsufsort):
+                for s in ["", "a", "mississippi", "acgt" * 50 + "ttgca",
+                          "àèì ciao", "a\ud800b"]:
+                    self.assertEqual(bwt.bwInverse(bwt.bwTransform(s)), s)
+
     def test_type_error(self):
         s = 56
         ## check that fails when the input is not a string
@@ -56,6 +133,14 @@ class TestBWT(unittest.TestCase):
         with self.assertRaises(bwt.TerminatorError) as e4:
             bwt.bwTransform(s, "+")
         self.assertEqual(e4.exception.error_code, 6)
+        with self.assertRaises(bwt.TerminatorError) as e6:
+            bwt.bwInverse(s, "+")
+        self.assertEqual(e6.exception.error_code, 6)
+        ## "$" is an ordinary character when another terminator is used
+        self.assertEqual(bwt.bwInverse(bwt.bwTransform("a$b$", "%"), "%"), "a$b$")
+        with self.assertRaises(bwt.TerminatorError) as e5:
+            bwt.bwInverse("o%i%c", "%")
+        self.assertEqual(e5.exception.error_code, 3)
         
         
 